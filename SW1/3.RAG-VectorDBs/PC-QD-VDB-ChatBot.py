@@ -1,12 +1,18 @@
 import os
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 import openai
-from sentence_transformers import SentenceTransformer
-import pinecone
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+UPSERT_BATCH_SIZE = 100  # Pinecone recommends at most 100 vectors per upsert request
+UPSERT_THREADS = 8  # Number of upsert requests sent to Pinecone in parallel
+
+def chunks(items: List, size: int):
+    """Split a list into consecutive chunks of at most size items"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 class VectorDBChatbot:
     def __init__(self, 
@@ -15,15 +21,33 @@ class VectorDBChatbot:
                  pinecone_environment: str = None,
                  qdrant_url: str = "http://localhost:6333",
                  use_pinecone: bool = True,
-                 use_qdrant: bool = True):
+                 use_qdrant: bool = True,
+                 cache_threshold: float = 0.97,
+                 embedding_cache_size: int = 10_000):
         
         # Initialize OpenAI
         openai.api_key = openai_api_key
         
         # Initialize embedding model
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # The heavy libraries (torch, pinecone, qdrant) are imported only when they are needed,
+        # so a backend that is switched off does not slow down the start up
+        from sentence_transformers import SentenceTransformer
+        # Runs on ONNX Runtime using the int8 (dynamically quantized) export of the model that is published
+        # with all-MiniLM-L6-v2 - much faster on CPU than PyTorch fp32 and encode() works the same way
+        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2',
+                                                   backend="onnx",
+                                                   model_kwargs={"file_name": "onnx/model_qint8_avx2.onnx"})
         self.embedding_dim = 384  # Dimension for all-MiniLM-L6-v2
         
+        # Semantic cache: db_type -> (normalized query embeddings, responses)
+        # A question whose cosine similarity to an earlier one is >= cache_threshold reuses its response
+        self.cache_threshold = cache_threshold
+        self.response_cache = {}
+        
+        # LRU cache of text -> embedding so the exact same text is never embedded twice
+        self.embedding_cache_size = embedding_cache_size
+        self.embedding_cache = OrderedDict()
+        
         # Initialize vector databases
         self.use_pinecone = use_pinecone
         self.use_qdrant = use_qdrant
@@ -37,6 +61,7 @@ class VectorDBChatbot:
     def _init_pinecone(self, api_key: str, environment: str):
         """Initialize Pinecone vector database"""
         try:
+            import pinecone
             pinecone.init(api_key=api_key, environment=environment)
             
             # Create index if it doesn't exist
@@ -48,7 +73,8 @@ class VectorDBChatbot:
                     metric='cosine'
                 )
             
-            self.pinecone_index = pinecone.Index(index_name)
+            # pool_threads lets upsert(async_req=True) send several batches in parallel
+            self.pinecone_index = pinecone.Index(index_name, pool_threads=UPSERT_THREADS)
             print("✅ Pinecone initialized successfully")
             
         except Exception as e:
@@ -58,6 +84,9 @@ class VectorDBChatbot:
     def _init_qdrant(self, url: str):
         """Initialize Qdrant vector database"""
         try:
+            from qdrant_client import QdrantClient
+            from qdrant_client.models import (Distance, VectorParams,
+                                              ScalarQuantization, ScalarQuantizationConfig, ScalarType)
             self.qdrant_client = QdrantClient(url=url)
             
             # Create collection if it doesn't exist
@@ -71,6 +100,13 @@ class VectorDBChatbot:
                     vectors_config=VectorParams(
                         size=self.embedding_dim,
                         distance=Distance.COSINE
+                    ),
+                    # Keep int8 quantized vectors in RAM for search - 4x smaller than float32
+                    quantization_config=ScalarQuantization(
+                        scalar=ScalarQuantizationConfig(
+                            type=ScalarType.INT8,
+                            always_ram=True
+                        )
                     )
                 )
             
@@ -81,29 +117,79 @@ class VectorDBChatbot:
             print(f"❌ Qdrant initialization failed: {e}")
             self.use_qdrant = False
     
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as normalized vectors, running the model only for texts that are not cached"""
+        embeddings = {text: self.embedding_cache[text] for text in texts if text in self.embedding_cache}
+        missing = [text for text in dict.fromkeys(texts) if text not in embeddings]
+        if missing:
+            new_embeddings = self.embedding_model.encode(missing,
+                                                         batch_size=64,
+                                                         convert_to_numpy=True,
+                                                         normalize_embeddings=True)
+            for text, embedding in zip(missing, new_embeddings):
+                embeddings[text] = embedding
+                self.embedding_cache[text] = embedding
+                if len(self.embedding_cache) > self.embedding_cache_size:
+                    self.embedding_cache.popitem(last=False)
+        for text in texts:
+            if text in self.embedding_cache:
+                self.embedding_cache.move_to_end(text)
+        return np.stack([embeddings[text] for text in texts])
+    
+    def _lookup_cached_response(self, query_embedding: np.ndarray, db_type: str) -> Optional[str]:
+        """Return the response to the most similar earlier question if it is similar enough"""
+        if db_type not in self.response_cache:
+            return None
+        cached_embeddings, responses = self.response_cache[db_type]
+        # Cosine similarity is just the dot product as all the embeddings are normalized
+        scores = cached_embeddings @ np.asarray(query_embedding, dtype=np.float32)
+        best = int(np.argmax(scores))
+        if scores[best] >= self.cache_threshold:
+            return responses[best]
+        return None
+    
+    def _cache_response(self, query_embedding: np.ndarray, db_type: str, response: str):
+        """Remember the response for this question embedding"""
+        # The embeddings are kept as one contiguous float32 matrix so that the lookup is a single
+        # vectorized (SIMD) matrix-vector product instead of a Python loop over cached questions
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)[None, :]
+        if db_type in self.response_cache:
+            cached_embeddings, responses = self.response_cache[db_type]
+            cached_embeddings = np.concatenate([cached_embeddings, query_embedding])
+            self.response_cache[db_type] = (cached_embeddings, responses + [response])
+        else:
+            self.response_cache[db_type] = (np.ascontiguousarray(query_embedding), [response])
+    
     def add_knowledge(self, texts: List[str], metadata: List[Dict] = None):
         """Add knowledge to both vector databases"""
         if not texts:
             return
         
-        # Generate embeddings
-        embeddings = self.embedding_model.encode(texts)
+        # The cached responses were generated without the new knowledge
+        self.response_cache.clear()
+        
+        # Generate embeddings - in batches, already normalized for cosine search
+        embeddings = self._embed(texts)
         
         if metadata is None:
             metadata = [{"text": text, "id": str(uuid.uuid4())} for text in texts]
         
+        # The same ids are used in both databases
+        ids = [meta.get("id", str(uuid.uuid4())) for meta in metadata]
+        payloads = [{"text": text, **meta} for text, meta in zip(texts, metadata)]
+        
         # Add to Pinecone
         if self.use_pinecone:
             try:
-                vectors = []
-                for i, (text, embedding, meta) in enumerate(zip(texts, embeddings, metadata)):
-                    vectors.append({
-                        "id": meta.get("id", str(uuid.uuid4())),
-                        "values": embedding.tolist(),
-                        "metadata": {"text": text, **meta}
-                    })
+                # The whole embeddings matrix is converted to lists in one call instead of one call per vector
+                vectors = [{"id": point_id, "values": values, "metadata": payload}
+                           for point_id, values, payload in zip(ids, embeddings.tolist(), payloads)]
                 
-                self.pinecone_index.upsert(vectors=vectors)
+                # Send the vectors in batches of 100, all in parallel, then wait for all of them
+                async_results = [self.pinecone_index.upsert(vectors=batch, async_req=True)
+                                 for batch in chunks(vectors, UPSERT_BATCH_SIZE)]
+                for async_result in async_results:
+                    async_result.get()
                 print(f"✅ Added {len(vectors)} vectors to Pinecone")
                 
             except Exception as e:
@@ -112,72 +198,98 @@ class VectorDBChatbot:
         # Add to Qdrant
         if self.use_qdrant:
             try:
-                points = []
-                for i, (text, embedding, meta) in enumerate(zip(texts, embeddings, metadata)):
-                    points.append(PointStruct(
-                        id=meta.get("id", str(uuid.uuid4())),
-                        vector=embedding.tolist(),
-                        payload={"text": text, **meta}
-                    ))
-                
-                self.qdrant_client.upsert(
+                # upload_collection takes the numpy embeddings matrix as is (no conversion to Python floats)
+                # and sends it in batches
+                self.qdrant_client.upload_collection(
                     collection_name=self.qdrant_collection,
-                    points=points
+                    vectors=embeddings,
+                    payload=payloads,
+                    ids=ids,
+                    batch_size=UPSERT_BATCH_SIZE,
+                    wait=True
                 )
-                print(f"✅ Added {len(points)} points to Qdrant")
+                print(f"✅ Added {len(ids)} points to Qdrant")
                 
             except Exception as e:
                 print(f"❌ Qdrant upsert failed: {e}")
     
-    def search_knowledge(self, query: str, top_k: int = 3, db_type: str = "both") -> Dict[str, List]:
+    def _search_pinecone(self, query_embedding: np.ndarray, top_k: int) -> List[Dict]:
+        """Search Pinecone for the closest matches"""
+        matches = []
+        try:
+            pinecone_results = self.pinecone_index.query(
+                vector=query_embedding.tolist(),
+                top_k=top_k,
+                include_metadata=True
+            )
+            
+            for match in pinecone_results['matches']:
+                matches.append({
+                    "text": match['metadata']['text'],
+                    "score": match['score'],
+                    "metadata": match['metadata']
+                })
+                
+        except Exception as e:
+            print(f"❌ Pinecone search failed: {e}")
+        return matches
+    
+    def _search_qdrant(self, query_embedding: np.ndarray, top_k: int) -> List[Dict]:
+        """Search Qdrant for the closest matches"""
+        matches = []
+        try:
+            qdrant_results = self.qdrant_client.search(
+                collection_name=self.qdrant_collection,
+                query_vector=query_embedding.tolist(),
+                limit=top_k
+            )
+            
+            for result in qdrant_results:
+                matches.append({
+                    "text": result.payload['text'],
+                    "score": result.score,
+                    "metadata": result.payload
+                })
+                
+        except Exception as e:
+            print(f"❌ Qdrant search failed: {e}")
+        return matches
+    
+    def search_knowledge(self, query: str, top_k: int = 3, db_type: str = "both",
+                         query_embedding: Optional[np.ndarray] = None) -> Dict[str, List]:
         """Search for relevant knowledge in vector databases"""
-        query_embedding = self.embedding_model.encode([query])[0]
+        if query_embedding is None:
+            query_embedding = self._embed([query])[0]
         results = {"pinecone": [], "qdrant": []}
         
-        # Search Pinecone
-        if self.use_pinecone and db_type in ["pinecone", "both"]:
-            try:
-                pinecone_results = self.pinecone_index.query(
-                    vector=query_embedding.tolist(),
-                    top_k=top_k,
-                    include_metadata=True
-                )
-                
-                for match in pinecone_results['matches']:
-                    results["pinecone"].append({
-                        "text": match['metadata']['text'],
-                        "score": match['score'],
-                        "metadata": match['metadata']
-                    })
-                    
-            except Exception as e:
-                print(f"❌ Pinecone search failed: {e}")
-        
-        # Search Qdrant
-        if self.use_qdrant and db_type in ["qdrant", "both"]:
-            try:
-                qdrant_results = self.qdrant_client.search(
-                    collection_name=self.qdrant_collection,
-                    query_vector=query_embedding.tolist(),
-                    limit=top_k
-                )
-                
-                for result in qdrant_results:
-                    results["qdrant"].append({
-                        "text": result.payload['text'],
-                        "score": result.score,
-                        "metadata": result.payload
-                    })
-                    
-            except Exception as e:
-                print(f"❌ Qdrant search failed: {e}")
+        # Search Pinecone and Qdrant at the same time - each search is a network round trip,
+        # so running them in parallel takes as long as the slower one instead of both added up
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = {}
+            if self.use_pinecone and db_type in ["pinecone", "both"]:
+                futures["pinecone"] = executor.submit(self._search_pinecone, query_embedding, top_k)
+            if self.use_qdrant and db_type in ["qdrant", "both"]:
+                futures["qdrant"] = executor.submit(self._search_qdrant, query_embedding, top_k)
+            for db_name, future in futures.items():
+                results[db_name] = future.result()
         
         return results
     
     def generate_response(self, query: str, db_type: str = "both") -> str:
         """Generate response using retrieved knowledge"""
+        return "".join(self.generate_response_stream(query, db_type=db_type))
+    
+    def generate_response_stream(self, query: str, db_type: str = "both") -> Iterator[str]:
+        """Generate response using retrieved knowledge, yielding the text as the LLM produces it"""
+        # Reuse the response to a similar earlier question if there is one
+        query_embedding = self._embed([query])[0]
+        cached_response = self._lookup_cached_response(query_embedding, db_type)
+        if cached_response is not None:
+            yield cached_response
+            return
+        
         # Search for relevant knowledge
-        search_results = self.search_knowledge(query, top_k=3, db_type=db_type)
+        search_results = self.search_knowledge(query, top_k=3, db_type=db_type, query_embedding=query_embedding)
         
         # Combine results from both databases
         all_contexts = []
@@ -186,16 +298,11 @@ class VectorDBChatbot:
         if search_results["qdrant"]:
             all_contexts.extend([r["text"] for r in search_results["qdrant"]])
         
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_contexts = []
-        for context in all_contexts:
-            if context not in seen:
-                seen.add(context)
-                unique_contexts.append(context)
+        # Remove duplicates while preserving order (dicts keep insertion order) and keep the top 5
+        unique_contexts = list(dict.fromkeys(all_contexts))[:5]
         
         # Create context for the prompt
-        context = "\n\n".join(unique_contexts[:5]) if unique_contexts else "No relevant information found."
+        context = "\n\n".join(unique_contexts) if unique_contexts else "No relevant information found."
         
         # Generate response using OpenAI
         try:
@@ -209,23 +316,28 @@ Context:
                     {"role": "user", "content": query}
                 ],
                 max_tokens=500,
-                temperature=0.7
+                temperature=0.7,
+                stream=True
             )
             
-            return response.choices[0].message.content
+            parts = []
+            for chunk in response:
+                content = chunk['choices'][0]['delta'].get('content', '')
+                parts.append(content)
+                yield content
+            self._cache_response(query_embedding, db_type, "".join(parts))
             
         except Exception as e:
-            return f"Sorry, I encountered an error generating the response: {e}"
+            yield f"Sorry, I encountered an error generating the response: {e}"
     
     def compare_databases(self, query: str) -> Dict:
         """Compare search results between databases"""
-        pinecone_results = self.search_knowledge(query, top_k=3, db_type="pinecone")
-        qdrant_results = self.search_knowledge(query, top_k=3, db_type="qdrant")
+        results = self.search_knowledge(query, top_k=3, db_type="both")
         
         return {
             "query": query,
-            "pinecone_results": pinecone_results["pinecone"],
-            "qdrant_results": qdrant_results["qdrant"]
+            "pinecone_results": results["pinecone"],
+            "qdrant_results": results["qdrant"]
         }
 
 # Example usage
@@ -277,12 +389,14 @@ def main():
                 print(f"  {i}. Score: {result['score']:.3f} - {result['text'][:100]}...")
         
         else:
-            response = chatbot.generate_response(user_input)
-            print(f"\n🤖 Bot: {response}")
+            print("\n🤖 Bot: ", end="", flush=True)
+            for chunk in chatbot.generate_response_stream(user_input):
+                print(chunk, end="", flush=True)
+            print()
 
 if __name__ == "__main__":
     # Install required packages:
-    # pip install openai sentence-transformers pinecone-client qdrant-client numpy
+    # pip install openai "sentence-transformers[onnx]" pinecone-client qdrant-client numpy
     
     # For Qdrant, you can run it locally with Docker:
     # docker run -p 6333:6333 qdrant/qdrant
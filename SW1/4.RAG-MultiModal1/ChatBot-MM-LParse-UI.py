@@ -1,16 +1,25 @@
 import nest_asyncio
 import os
+import multiprocessing
+import threading
 import faiss
 import numpy as np
 from llama_parse import LlamaParse
 from llama_index.core.schema import TextNode
+from llama_index.core.node_parser import SentenceSplitter
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from transformers import BlipProcessor, BlipForConditionalGeneration
 from llama_index.llms.mistralai import MistralAI
 from PIL import Image
 import torch
+from torch.utils.data import Dataset, DataLoader
 from dotenv import load_dotenv
 import pickle
+import json
+import hashlib
+from collections import OrderedDict
+import pyarrow as pa
+import pyarrow.parquet as pq
 import streamlit as st
 
 nest_asyncio.apply()
@@ -19,102 +28,327 @@ nest_asyncio.apply()
 load_dotenv()
 
 # Constants
-FAISS_INDEX_FILE = "faiss_index.index"
-NODES_DATA_FILE = "nodes_data.pkl"
-IMAGE_METADATA_FILE = "processed_images.pkl"
+# The page text is split into chunks of about this many tokens (with this much overlap between chunks)
+# before embedding - the embedding model only looks at the first 512 tokens, so a long page would lose text
+TEXT_CHUNK_SIZE = 200
+TEXT_CHUNK_OVERLAP = 50
+
+# Everything that is built from a PDF is saved with the hash of the PDF bytes in its file name,
+# so switching between PDFs does not overwrite (or wrongly reuse) the files of another PDF.
+# The index, nodes and embeddings also carry the chunk settings, so an index built with other settings
+# (or before the text was chunked at all) is not loaded - it is built again instead
+CACHE_DIR = "cache"
+INDEX_BUILD = f"chunk{TEXT_CHUNK_SIZE}-{TEXT_CHUNK_OVERLAP}"
+PARSED_JSON_FILE = os.path.join(CACHE_DIR, "{pdf_hash}.json")  # LlamaParse result
+FAISS_INDEX_FILE = os.path.join(CACHE_DIR, "faiss_{pdf_hash}_" + INDEX_BUILD + ".index")
+NODES_DATA_FILE = os.path.join(CACHE_DIR, "nodes_{pdf_hash}_" + INDEX_BUILD + ".parquet")
+EMBEDDINGS_FILE = os.path.join(CACHE_DIR, "embeddings_{pdf_hash}_" + INDEX_BUILD + ".npy")  # (nodes x dimension) float32 matrix
+CAPTION_CACHE_FILE = os.path.join(CACHE_DIR, "captions.json")  # sha256 of the image bytes -> BLIP caption
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# HNSW graph parameters - M is the number of neighbours per node, efConstruction/efSearch
+# trade build/query time for recall.  Higher values = better recall but slower.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 40
+
+# Semantic cache of earlier questions - a new question this similar (cosine) to an earlier one reuses its answer
+QUERY_CACHE_INDEX_FILE = os.path.join(CACHE_DIR, "query_cache_{pdf_hash}.index")
+QUERY_CACHE_DATA_FILE = os.path.join(CACHE_DIR, "query_cache_{pdf_hash}.pkl")
+QUERY_CACHE_THRESHOLD = 0.97
+
+# Max number of text -> embedding pairs kept in memory so the exact same text is never embedded twice
+EMBEDDING_CACHE_SIZE = 10_000
+
+# BLIP and the embedding model run on the GPU if one is available - BLIP in half precision (fp16) on the GPU
+device = "cuda" if torch.cuda.is_available() else "cpu"
+blip_dtype = torch.float16 if device == "cuda" else torch.float32
+BLIP_BATCH_SIZE = 16  # Number of images captioned in one generate call
+# Worker processes that load and preprocess the next batches of images while BLIP captions the current one.
+# Only where workers are forked (Linux) - with "spawn" (Windows, macOS) each worker re-imports the script, which
+# does not work under Streamlit, so the images are loaded in the main process there
+BLIP_LOADER_WORKERS = 4 if multiprocessing.get_start_method() == "fork" else 0
+
+# Streamlit re-runs this whole script on every interaction, so the models are created once
+# in a cached function and the same objects are handed back on every rerun
+@st.cache_resource
+def get_models():
+    """Initialize the embedding model, LlamaParse, the LLM and the BLIP captioning model"""
+    embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5", embed_batch_size=64, device=device,
+                                       normalize=True)  # Normalized embeddings, ready for cosine search
+    parser = LlamaParse(api_key=os.getenv("LLAMA_CLOUD_API_KEY"), result_type="markdown")
+    llm = MistralAI(api_key=os.getenv("MISTRAL_API_KEY"), model="mistral-small")  # For generation
+
+    # Initialize BLIP model for image captioning
+    blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
+    blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base",
+                                                              torch_dtype=blip_dtype).to(device).eval()
+    if device == "cuda":
+        # The BLIP vision encoder always gets 384x384 images, so it compiles to a fixed graph (CUDA graphs).
+        # The text decoder changes shape with every generated token, so it is not compiled
+        blip_model.vision_model = torch.compile(blip_model.vision_model, mode="reduce-overhead")
+    return embed_model, parser, llm, blip_processor, blip_model
 
 # Initialize components
-embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
-parser = LlamaParse(api_key=os.getenv("LLAMA_CLOUD_API_KEY"), result_type="markdown")
-llm = MistralAI(api_key=os.getenv("MISTRAL_API_KEY"), model="mistral-small")  # For generation
-
-# Initialize BLIP model for image captioning
-blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-
-def generate_alt_text(image_path):
-    """Generate alt text for an image using BLIP model"""
-    image = Image.open(image_path).convert("RGB")
-    inputs = blip_processor(images=image, return_tensors="pt")
-    with torch.no_grad():
-        caption = blip_model.generate(**inputs)
-    return blip_processor.decode(caption[0], skip_special_tokens=True)
-
-def load_processed_images():
-    """Load set of already processed images"""
-    if os.path.exists(IMAGE_METADATA_FILE):
-        with open(IMAGE_METADATA_FILE, "rb") as f:
-            return pickle.load(f)
-    return set()
-
-def save_processed_images(processed_images):
-    """Save set of processed images"""
-    with open(IMAGE_METADATA_FILE, "wb") as f:
-        pickle.dump(processed_images, f)
-
-def process_new_images(json_objs, processed_images):
-    """Process only new images in the PDF"""
-    print("Proces New Image")
+embed_model, parser, llm, blip_processor, blip_model = get_models()
+
+@st.cache_resource
+def get_embedding_cache():
+    """LRU cache of text -> embedding, kept across Streamlit reruns"""
+    return OrderedDict()
+
+def remember_embedding(text, embedding):
+    """Add an embedding to the LRU cache, dropping the least recently used one if the cache is full"""
+    embedding_cache = get_embedding_cache()
+    embedding_cache[text] = embedding
+    embedding_cache.move_to_end(text)
+    if len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+        embedding_cache.popitem(last=False)
+
+def embed_cached(text):
+    """Embed a text, reusing the embedding if the exact same text was embedded before"""
+    embedding_cache = get_embedding_cache()
+    if text in embedding_cache:
+        embedding_cache.move_to_end(text)
+        return embedding_cache[text]
+    embedding = embed_model.get_text_embedding(text)
+    remember_embedding(text, embedding)
+    return embedding
+
+def embed_cached_batch(texts):
+    """Embed a list of texts in batches, running the model only for the texts that are not cached"""
+    embedding_cache = get_embedding_cache()
+    embeddings = {text: embedding_cache[text] for text in texts if text in embedding_cache}
+    missing = [text for text in dict.fromkeys(texts) if text not in embeddings]
+    if missing:
+        for text, embedding in zip(missing, embed_model.get_text_embedding_batch(missing, show_progress=True)):
+            embeddings[text] = embedding
+            remember_embedding(text, embedding)
+    return [embeddings[text] for text in texts]
+
+class ImageDataset(Dataset):
+    """The images to caption - opened by the DataLoader workers"""
+    def __init__(self, image_paths):
+        self.image_paths = image_paths
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, i):
+        return Image.open(self.image_paths[i]).convert("RGB")
+
+def collate_images(images):
+    """Turn a batch of images into BLIP input tensors"""
+    return dict(blip_processor(images=images, return_tensors="pt"))
+
+def generate_alt_text(image_paths):
+    """Generate alt text for the images using BLIP model, one batch at a time"""
+    # pin_memory puts the batches in page-locked memory so the copy to the GPU can run asynchronously
+    loader = DataLoader(ImageDataset(image_paths), batch_size=BLIP_BATCH_SIZE, collate_fn=collate_images,
+                        num_workers=BLIP_LOADER_WORKERS, pin_memory=device == "cuda")
+    alt_texts = []
+    for batch in loader:
+        inputs = {name: tensor.to(device, non_blocking=True) for name, tensor in batch.items()}
+        inputs["pixel_values"] = inputs["pixel_values"].to(blip_dtype)
+        with torch.inference_mode():
+            captions = blip_model.generate(**inputs)
+        alt_texts.extend(blip_processor.batch_decode(captions, skip_special_tokens=True))
+    return alt_texts
+
+def load_caption_cache():
+    """Load the captions of images that were captioned before, keyed by the hash of the image bytes"""
+    if os.path.exists(CAPTION_CACHE_FILE):
+        with open(CAPTION_CACHE_FILE) as f:
+            return json.load(f)
+    return {}
+
+def save_caption_cache(caption_cache):
+    """Save the image captions"""
+    with open(CAPTION_CACHE_FILE, "w") as f:
+        json.dump(caption_cache, f)
+
+def image_hash(image_path):
+    """sha256 of the image file - the same image gets the same hash whatever its path is"""
+    with open(image_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def process_images(json_objs):
+    """Create one node per image in the PDF, with the BLIP caption of the image as its text"""
+    print("Proces Images")
     image_dicts = parser.get_images(json_objs, download_path="llamaimages")
+    new_paths = list(dict.fromkeys(image_dict["path"] for image_dict in image_dicts))
     new_nodes = []
-    
-    for image_dict in image_dicts:
-        image_path = image_dict["path"]
-        if image_path not in processed_images:
-            alt_text = generate_alt_text(image_path)
-            new_nodes.append(TextNode(text=alt_text, metadata={"path": image_path}))
-            processed_images.add(image_path)
-    
-    save_processed_images(processed_images)
+
+    # Only images whose content was never captioned before go through BLIP (the same PDF uploaded
+    # again, or the same image in another PDF, reuses the saved caption)
+    caption_cache = load_caption_cache()
+    image_hashes = {image_path: image_hash(image_path) for image_path in new_paths}
+    to_caption = {}
+    for image_path in new_paths:
+        if image_hashes[image_path] not in caption_cache:
+            to_caption.setdefault(image_hashes[image_path], image_path)
+
+    # Caption the new images in batches rather than one BLIP call per image
+    for hash_key, alt_text in zip(to_caption, generate_alt_text(list(to_caption.values()))):
+        caption_cache[hash_key] = alt_text
+    save_caption_cache(caption_cache)
+
+    for image_path in new_paths:
+        new_nodes.append(TextNode(text=caption_cache[image_hashes[image_path]], metadata={"path": image_path}))
     return new_nodes
 
-def load_or_create_index(pdf_path):
+class ParquetNodes:
+    """Read-only list of nodes backed by a memory-mapped parquet file.
+    Only the nodes that are actually accessed are turned into TextNode objects."""
+    def __init__(self, path):
+        self.table = pq.read_table(path, memory_map=True)
+        self.texts = self.table.column("text")
+        self.metadata = self.table.column("metadata_json")
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __getitem__(self, i):
+        return TextNode(text=self.texts[i].as_py(), metadata=json.loads(self.metadata[i].as_py()))
+
+def save_nodes(nodes, path):
+    """Save the text and metadata of the nodes as columns in a parquet file"""
+    table = pa.table({
+        "text": [node.text for node in nodes],
+        "metadata_json": [json.dumps(node.metadata) for node in nodes]
+    })
+    pq.write_table(table, path)
+
+class QueryCache:
+    """Semantic cache that maps the embedding of an earlier question to its (response, context nodes).
+    One object per PDF is shared by all the sessions (see get_query_cache), so it is guarded by a lock"""
+    def __init__(self, pdf_hash, threshold=QUERY_CACHE_THRESHOLD):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.index_file = QUERY_CACHE_INDEX_FILE.format(pdf_hash=pdf_hash)
+        self.data_file = QUERY_CACHE_DATA_FILE.format(pdf_hash=pdf_hash)
+        self.index = None
+        self.entries = []
+        if os.path.exists(self.index_file) and os.path.exists(self.data_file):
+            self.index = faiss.read_index(self.index_file)
+            with open(self.data_file, "rb") as f:
+                self.entries = pickle.load(f)
+
+    def lookup(self, query_embedding):
+        """Return the cached entry of the closest earlier question if it is similar enough, else None"""
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return None
+            scores, indices = self.index.search(query_embedding, 1)
+            if scores[0][0] >= self.threshold:
+                return self.entries[indices[0][0]]
+            return None
+
+    def add(self, query_embedding, entry):
+        """Add a question embedding and its entry to the cache and save the cache to disk"""
+        with self.lock:
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(query_embedding.shape[1])
+            self.index.add(query_embedding)
+            self.entries.append(entry)
+            faiss.write_index(self.index, self.index_file)
+            with open(self.data_file, "wb") as f:
+                pickle.dump(self.entries, f)
+
+@st.cache_resource(show_spinner=False)
+def get_query_cache(pdf_hash):
+    """Create the semantic cache once per PDF - all the sessions share it, so they do not overwrite each other's files"""
+    return QueryCache(pdf_hash)
+
+def clear_query_cache(pdf_hash):
+    """Delete the saved semantic cache - the cached answers belong to the old index"""
+    get_query_cache.clear()
+    for cache_file in (QUERY_CACHE_INDEX_FILE, QUERY_CACHE_DATA_FILE):
+        cache_file = cache_file.format(pdf_hash=pdf_hash)
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+
+def parse_pdf(pdf_path, pdf_hash):
+    """Parse the PDF with LlamaParse, reusing the saved result if the same PDF was parsed before"""
+    json_file = PARSED_JSON_FILE.format(pdf_hash=pdf_hash)
+    if os.path.exists(json_file):
+        print("Using the saved LlamaParse result...")
+        with open(json_file) as f:
+            return json.load(f)
+
+    json_objs = parser.get_json_result(pdf_path)
+    with open(json_file, "w") as f:
+        json.dump(json_objs, f)
+    return json_objs
+
+def load_or_create_index(pdf_path, pdf_hash):
     """Load existing index or create new one if needed"""
-    if os.path.exists(FAISS_INDEX_FILE) and os.path.exists(NODES_DATA_FILE):
+    index_file = FAISS_INDEX_FILE.format(pdf_hash=pdf_hash)
+    nodes_file = NODES_DATA_FILE.format(pdf_hash=pdf_hash)
+    if os.path.exists(index_file) and os.path.exists(nodes_file):
         print("Loading existing FAISS index...")
-        index = faiss.read_index(FAISS_INDEX_FILE)
-        with open(NODES_DATA_FILE, "rb") as f:
-            nodes = pickle.load(f)
+        # Memory-map the stored vectors of the index (and the nodes) instead of copying them into memory.
+        # IO_FLAG_MMAP_IFC is needed for our HNSW index - the plain IO_FLAG_MMAP only maps the lists of IVF indexes
+        index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        nodes = ParquetNodes(nodes_file)
         return index, nodes
     
     print("Creating new FAISS index...")
     # Parse PDF and process content
-    json_objs = parser.get_json_result(pdf_path)
+    json_objs = parse_pdf(pdf_path, pdf_hash)
     json_list = json_objs[0]["pages"]
     
-    # Process text nodes
-    text_nodes = [TextNode(text=page["text"], metadata={"page": page["page"]}) 
-                 for page in json_list]
+    # Process text nodes - one node per chunk of the page text
+    text_splitter = SentenceSplitter(chunk_size=TEXT_CHUNK_SIZE, chunk_overlap=TEXT_CHUNK_OVERLAP)
+    text_nodes = [TextNode(text=chunk, metadata={"page": page["page"], "chunk_id": chunk_id})
+                  for page in json_list
+                  for chunk_id, chunk in enumerate(text_splitter.split_text(page["text"]))]
     
-    # Process only new images
-    processed_images = load_processed_images()
-    image_nodes = process_new_images(json_objs, processed_images)
+    # Process the images - every image of this PDF gets a node, already captioned images reuse their saved caption
+    image_nodes = process_images(json_objs)
     
     # This is where we merge the Text and Image Nodes
     print("Now merging the Text and Image Nodes")
     nodes = text_nodes + image_nodes
     
     # Create FAISS index
-    embeddings = [embed_model.get_text_embedding(node.text) for node in nodes]
-    dimension = len(embeddings[0])
-    index = faiss.IndexFlatL2(dimension)
-    index.add(np.array(embeddings).astype('float32'))
+    # We use an HNSW (graph based) index instead of a flat index so that a query does not have to
+    # be compared against every single node.  The BGE embeddings are meant for cosine similarity,
+    # the embedding model already returns them normalized, so we use Inner Product as the metric.
+    # All the nodes are embedded in batches in one call instead of one model call per node
+    # The embeddings are kept as one contiguous (nodes x dimension) float32 matrix which FAISS uses without a copy
+    embeddings = np.ascontiguousarray(embed_cached_batch([node.text for node in nodes]), dtype=np.float32)
+    dimension = embeddings.shape[1]
+    # The vectors are stored as 8-bit scalar-quantized values (4x smaller than float32)
+    # The quantizer has to be trained on the embeddings first to learn the range of each dimension
+    index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings)
+    index.add(embeddings)
     
     # Save index and nodes
-    faiss.write_index(index, FAISS_INDEX_FILE)
-    with open(NODES_DATA_FILE, "wb") as f:
-        pickle.dump(nodes, f)
+    faiss.write_index(index, index_file)
+    save_nodes(nodes, nodes_file)
+    np.save(EMBEDDINGS_FILE.format(pdf_hash=pdf_hash), embeddings)
+    clear_query_cache(pdf_hash)
     
     return index, nodes
 
-def query_index(index, nodes, query, k=3):
+def embed_query(query):
+    """Embed the query as a normalized (1, dimension) float32 array"""
+    return np.asarray(embed_cached(query), dtype=np.float32).reshape(1, -1)
+
+def query_index(index, nodes, query, k=3, query_embedding=None):
     """Query the FAISS index"""
-    query_embedding = embed_model.get_text_embedding(query)
-    distances, indices = index.search(np.array([query_embedding]).astype('float32'), k)
-    return [nodes[i] for i in indices[0]]
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    scores, indices = index.search(query_embedding, k)
+    # FAISS returns -1 when it finds fewer than k neighbours
+    return [nodes[i] for i in indices[0] if i >= 0]
 
 def generate_response(query, context_nodes):
-    """Generate LLM response using retrieved context"""
+    """Generate LLM response using retrieved context, yielding the text as the LLM produces it"""
     # Combine all context into a single string
     context = "\n\n".join([f"Source {i+1} (from {node.metadata}):\n{node.text}" 
                           for i, node in enumerate(context_nodes)])
@@ -129,9 +363,34 @@ def generate_response(query, context_nodes):
     Question: {query}
     Answer: """
     
-    # Get LLM response
-    response = llm.complete(prompt)
-    return response.text
+    # Stream the LLM response so that the first words show up without waiting for the whole answer
+    for response in llm.stream_complete(prompt):
+        yield response.delta
+
+@st.cache_resource(show_spinner=False)
+def get_index(pdf_hash, pdf_path):
+    """Load or create the index once per PDF - the hash of the PDF bytes is the cache key,
+    so processing the same PDF again does not parse or embed anything"""
+    return load_or_create_index(pdf_path, pdf_hash)
+
+def answer_question(index, nodes, query_cache, query, k=8):
+    """Answer from the semantic cache if a similar question was asked before, else retrieve and generate.
+    Returns the answer - a string if it came from the cache, else a generator of text chunks - and the context nodes"""
+    query_embedding = embed_query(query)
+    cached = query_cache.lookup(query_embedding)
+    if cached is not None:
+        return cached
+
+    results_context = query_index(index, nodes, query, k=k, query_embedding=query_embedding)
+
+    def stream_and_cache():
+        chunks = []
+        for chunk in generate_response(query, results_context):
+            chunks.append(chunk)
+            yield chunk
+        query_cache.add(query_embedding, ("".join(chunks), results_context))
+
+    return stream_and_cache(), results_context
 
 # Main execution flow
 if __name__ == "__main__":
@@ -144,25 +403,32 @@ if __name__ == "__main__":
             f.write(pdf_file.getbuffer())
 
     if st.button("Process PDF"):
-        with st.spinner(f"Extracting and Processing {pdf_file} ..."):            
-            # Step 1: Load or create index
-            index, nodes = load_or_create_index("temp.pdf")
-            st.session_state['index'] = index
-            st.session_state['nodes'] = nodes
-            st.success("Processing complete ...")
+        # The index is found by the hash of the PDF bytes, so there has to be an uploaded PDF
+        if pdf_file is None:
+            st.warning("Please upload a PDF first")
+        else:
+            with st.spinner(f"Extracting and Processing {pdf_file} ..."):            
+                # Step 1: Load or create index
+                pdf_hash = hashlib.blake2b(pdf_file.getvalue(), digest_size=16).hexdigest()
+                index, nodes = get_index(pdf_hash, "temp.pdf")
+                st.session_state['index'] = index
+                st.session_state['nodes'] = nodes
+                st.session_state['query_cache'] = get_query_cache(pdf_hash)
+                st.success("Processing complete ...")
 
     if 'index' in st.session_state:    
         # Step 2: Query the index
         question = st.text_input("🤖Hi!! there, Ask me a question about your document: ")
         if question:
             with st.spinner("🕵🏻Searching... Hang in there... "):
-                results_context = query_index(st.session_state['index'], st.session_state['nodes'], question, k=8)
-    
-
-                # Use an LLM to Generate a Response for the Question asked
-                response = generate_response(question, results_context)
+                # Use an LLM to Generate a Response for the Question asked (or reuse the answer to a similar question)
+                response, results_context = answer_question(st.session_state['index'], st.session_state['nodes'],
+                                                            st.session_state['query_cache'], question, k=8)
                 st.caption(f"❓Your Question: {question}")
-                st.markdown(f"👉{response}")    
+                if isinstance(response, str):
+                    st.markdown(f"👉{response}")
+                else:
+                    st.write_stream(response)
             
                 # Display results directly retrieved from the Vector DB
                 with st.expander("📃View supporting content ..."):
@@ -3,11 +3,15 @@
 # Using a simplified ABI, it retrieves each token’s symbol, decimals, total supply, and the balance held by a 
 # specific Ethereum address (a Uniswap liquidity pool). 
 # The values are normalized using the token's decimals() to be human-readable. 
+# All the calls are batched into a single RPC call using the Multicall3 contract.
+# symbol() and decimals() never change for a token, so they are fetched once and saved in ~/.cache/tokens.json
 # The results for both tokens are printed to the console. 
 # The program demonstrates how to query token metadata and balances without needing a private API key or full ABI.
 # Refer to: https://etherscan.io/tokens to get a list of Tokens and check their details
 
 from web3 import Web3
+import json
+import os
 
 # Using the Etherem Mainnet to Read NFT Token Details.  The URL to be used in Web3 is below
 w3 = Web3(Web3.HTTPProvider("https://eth-mainnet.public.blastapi.io"))
@@ -46,52 +50,73 @@ simplified_abi = [
     }
 ]
 
-dai_contract = w3.eth.contract(address=w3.to_checksum_address(dai_token_addr), abi=simplified_abi)
-print(dai_contract)
+#Tether and BNB Token Addr
+tether_token_addr = "0xdAC17F958D2ee523a2206206994597C13D831ec7"
+bnb_token_addr = "0xB8c77482e45F1F44dE1745F52C74426C631bDD52"
+
+token_addrs = [dai_token_addr, weth_token_addr, tether_token_addr, bnb_token_addr]
 
-symbol = dai_contract.functions.symbol().call()
-decimals = dai_contract.functions.decimals().call()
-totalSupply = dai_contract.functions.totalSupply().call() / 10**decimals
-addr_balance = dai_contract.functions.balanceOf(acc_address).call() / 10**decimals
+# Multicall3 is a contract deployed at the same address on Ethereum and most other chains.
+# Its aggregate() function takes a list of (contract address, encoded function call) pairs, makes all
+# those calls on-chain and returns all the results - so we need only ONE RPC call to the node instead
+# of one RPC call per method per token (4 tokens x 4 methods = 16 round trips).
+multicall_addr = "0xcA11bde05977b3631167028862bE2a173976CA11"
+multicall_abi = [
+    {
+        'inputs': [{'components': [{'internalType': 'address', 'name': 'target', 'type': 'address'},
+                                   {'internalType': 'bytes', 'name': 'callData', 'type': 'bytes'}],
+                    'internalType': 'struct Multicall3.Call[]', 'name': 'calls', 'type': 'tuple[]'}],
+        'name': 'aggregate',
+        'outputs': [{'internalType': 'uint256', 'name': 'blockNumber', 'type': 'uint256'},
+                    {'internalType': 'bytes[]', 'name': 'returnData', 'type': 'bytes[]'}],
+        'stateMutability': 'payable', 'type': 'function'
+    }
+]
+multicall_contract = w3.eth.contract(address=multicall_addr, abi=multicall_abi)
 
-#  DAI
-print("===== %s =====" % symbol)
-print("Total Supply:", totalSupply)
-print("Addr Balance:", addr_balance)
+# One contract object (without an address) is enough to encode the calls for all the tokens as they share the ABI
+token_contract = w3.eth.contract(abi=simplified_abi)
 
-weth_contract = w3.eth.contract(address=w3.to_checksum_address(weth_token_addr), abi=simplified_abi)
-symbol = weth_contract.functions.symbol().call()
-decimals = weth_contract.functions.decimals().call()
-totalSupply = weth_contract.functions.totalSupply().call() / 10**decimals
-addr_balance = weth_contract.functions.balanceOf(acc_address).call() / 10**decimals
+# symbol and decimals of the tokens that we have seen before - these never change once a token is deployed
+token_cache_file = os.path.join(os.path.expanduser("~"), ".cache", "tokens.json")
+token_meta = {}
+if os.path.exists(token_cache_file):
+    with open(token_cache_file) as f:
+        token_meta = json.load(f)
 
-#  WETH
-print("===== %s =====" % symbol)
-print("Total Supply:", totalSupply)
-print("Addr Balance:", addr_balance)
+# The methods that we call on the tokens, with their arguments and the type of their return value
+# meta_methods are called only for tokens that are not in the cache, live_methods are called every time
+meta_methods = [
+    ("symbol", [], "string"),
+    ("decimals", [], "uint8")
+]
+live_methods = [
+    ("totalSupply", [], "uint256"),
+    ("balanceOf", [acc_address], "uint256")
+]
 
-#Tether Token Addr
-tether_token_addr = "0xdAC17F958D2ee523a2206206994597C13D831ec7"
-teth_contract = w3.eth.contract(address=w3.to_checksum_address(tether_token_addr), abi=simplified_abi)
-symbol = teth_contract.functions.symbol().call()
-decimals = teth_contract.functions.decimals().call()
-totalSupply = teth_contract.functions.totalSupply().call() / 10**decimals
-addr_balance = teth_contract.functions.balanceOf(acc_address).call() / 10**decimals
+token_calls = []  # (token address, methods called on it) in the order of the calls
+calls = []
+for token_addr in token_addrs:
+    methods = live_methods if token_addr in token_meta else meta_methods + live_methods
+    token_calls.append((token_addr, methods))
+    calls += [(w3.to_checksum_address(token_addr), token_contract.encode_abi(method, args=args))
+              for method, args, _ in methods]
+block_number, return_data = multicall_contract.functions.aggregate(calls).call()
 
-#  Tether
-print("===== %s =====" % symbol)
-print("Total Supply:", totalSupply)
-print("Addr Balance:", addr_balance)
+# The results come back in the same order as the calls
+results = iter(return_data)
+for token_addr, methods in token_calls:
+    values = {method: w3.codec.decode([return_type], next(results))[0] for method, _, return_type in methods}
+    if token_addr not in token_meta:
+        token_meta[token_addr] = {"symbol": values["symbol"], "decimals": values["decimals"]}
+    symbol = token_meta[token_addr]["symbol"]
+    decimals = token_meta[token_addr]["decimals"]
 
-#BNB Token Addr
-bnb_token_addr = "0xB8c77482e45F1F44dE1745F52C74426C631bDD52"
-bnb_contract = w3.eth.contract(address=w3.to_checksum_address(bnb_token_addr), abi=simplified_abi)
-symbol = bnb_contract.functions.symbol().call()
-decimals = bnb_contract.functions.decimals().call()
-totalSupply = bnb_contract.functions.totalSupply().call() / 10**decimals
-addr_balance = bnb_contract.functions.balanceOf(acc_address).call() / 10**decimals
+    print("===== %s =====" % symbol)
+    print("Total Supply:", values["totalSupply"] / 10**decimals)
+    print("Addr Balance:", values["balanceOf"] / 10**decimals)
 
-#  BNB
-print("===== %s =====" % symbol)
-print("Total Supply:", totalSupply)
-print("Addr Balance:", addr_balance)
\ No newline at end of file
+os.makedirs(os.path.dirname(token_cache_file), exist_ok=True)
+with open(token_cache_file, "w") as f:
+    json.dump(token_meta, f, indent=2)
@@ -5,8 +5,14 @@
 #Credits: Hardhat, ChatGPT, Author's own imagination, Tarun Rama
 
 from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from web3 import Web3
+from eth_abi import decode as abi_decode
 import json
 import os
 from dotenv import load_dotenv
@@ -14,7 +20,9 @@ from datetime import datetime
 from requests_toolbelt import MultipartEncoder
 from pathlib import Path
 from collections import OrderedDict
-import pyshorteners
+from concurrent.futures import ThreadPoolExecutor
+import diskcache
+import functools
 
 load_dotenv()
 
@@ -29,45 +37,118 @@ contractJSON = r"E:\Deshmukh2025\PESU-CIE\Projects\StudentNFT\Solidity\artifacts
 pinataJWT = os.getenv("PINATA_JWT") #JWT Token for Pinata
 pinataBaseURL = os.getenv("PINATA_BASE_URL") #Base URL for Pinata
 pinataLegacyURL = os.getenv("PINATA_LEGACY_URL")
-STUDENT_BADGE_DATA = "./StudentBadges/StudentBadgeData.json"
+STUDENT_BADGE_DATA = "./StudentBadges/StudentBadgeData.jsonl" #JSON Lines - one Badge record per line
 CERTIFICATE_DIR = "certificates"
+METADATA_FETCH_THREADS = 16 #Number of Metadata URIs fetched from the Pinata gateway at the same time
+BADGE_CACHE_DIR = "./.badge_cache" #On-disk cache of the tokenURIs and the Metadata of the Minted Badges
+METADATA_CACHE_SECONDS = 3600 #How long the Metadata read from the Pinata gateway is kept in the cache
+REQUIRED_FIELDS = frozenset({"student_name", "class_semester", "university", "badge_type"}) #Fields that /uploadMetadata must receive
+IPFS_GATEWAY_URL = "https://gateway.pinata.cloud/ipfs/" #Gateway used to turn ipfs:// URIs into links that a browser can open
 
 #Pinata Headers for API Calls
 PINATA_JWT = os.getenv("PINATA_JWT")
 HEADERS = {
     "Authorization": f"Bearer {PINATA_JWT}"
 }
+#One HTTP Session is shared by all the calls to Pinata and the IPFS gateway.  It keeps the connections open (keep-alive)
+#so the TCP and TLS handshakes are done once and not on every call, and retries calls that fail for temporary reasons.
+#raise_on_status=False returns the last error response once the retries are used up (instead of raising an error),
+#so the callers can check the status code as before - e.g. one bad gateway response only drops that one Badge
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64,
+                                      max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                                                        raise_on_status=False)))
+#urllib3 does not retry POST calls by default.  Pinning the Metadata JSON (api.pinata.cloud) is safe to send again as the
+#same JSON is pinned with the same CID, so a 429 (rate limited) answer is retried after waiting as asked in its Retry-After.
+#The file upload (uploads.pinata.cloud) is NOT retried: its body is streamed from the open file by the MultipartEncoder
+#and is already used up after the first try, so it cannot be sent again
+SESSION.mount("https://api.pinata.cloud/", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[429],
+                                                                        allowed_methods=["POST"], raise_on_status=False)))
+
+#orjson is a much faster JSON library than the built-in json module.  This tells Flask to use it in jsonify and request.get_json
+class ORJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize Flask app
 app = Flask(__name__)
-
-# Connect to local node
-web3 = Web3(Web3.HTTPProvider(localRPC))
-assert web3.is_connected()
-
-# Load contract ABI
-with open(contractJSON) as f:
-    abi = json.load(f)['abi']
-
-#Get the Smart Contract handle which will be used in the API Functions below
-contract = web3.eth.contract(contractAddress, abi=abi)
+app.json = ORJSONProvider(app)
+#Compress the responses (Brotli or gzip, whichever the client accepts) as the list of Minted Badges repeats the same field names
+#for every Badge and becomes many times smaller.  Small responses are sent as they are
+app.config["COMPRESS_MIN_SIZE"] = 1024
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+Compress(app)
+
+#Connect to the local node and load the Smart Contract only when an API first needs it and not when this file is imported,
+#so the API starts instantly and can be imported (for tests or health checks) without a running Hardhat node.
+#lru_cache makes sure this is done only once per process and the same handles are returned on every later call
+@functools.lru_cache(maxsize=1)
+def get_contract():
+    # Connect to local node
+    #cache_allowed_requests makes web3 remember the answers of calls that do not change, like eth_chainId,
+    #instead of asking the node again on every contract call
+    web3 = Web3(Web3.HTTPProvider(localRPC, cache_allowed_requests=True))
+
+    # Load contract ABI
+    with open(contractJSON) as f:
+        abi = json.load(f)['abi']
+
+    #Get the Smart Contract handle which will be used in the API Functions below
+    return web3, web3.eth.contract(contractAddress, abi=abi)
+
+#The 4 byte selector of tokenURI(uint256) is computed once, so list_minted_badges can build the eth_call data itself
+#instead of web3 looking up and encoding the function from the ABI for every token
+TOKEN_URI_SELECTOR = Web3.keccak(text="tokenURI(uint256)")[:4]
+
+#The Chain ID never changes for a running node so we read it once and pass it explicitly when building transactions
+@functools.lru_cache(maxsize=1)
+def get_chain_id():
+    web3, _ = get_contract()
+    return web3.eth.chain_id
+
+#The hash of the first (genesis) block identifies the chain the node is running.  A restarted Hardhat node starts a new chain
+#but a fresh deploy lands at the same contract address, so the cached tokenURIs are kept per chain and not only per address.
+#It is not memoized as the node can be restarted while this API keeps running
+def get_chain_key():
+    web3, _ = get_contract()
+    return Web3.to_hex(web3.eth.get_block(0)["hash"])
+
+#The tokenURI of a Badge never changes once it is minted and the Metadata is stored on IPFS by its content hash (CID),
+#so both can be cached on disk and repeated listings do not have to go to the Blockchain or the Pinata gateway again
+badgeCache = diskcache.Cache(BADGE_CACHE_DIR)
 
 # Utility: get nonce
 def get_nonce(address):
+    web3, _ = get_contract()
     return web3.eth.get_transaction_count(address)
 
 def uploadToPinata(filePath, metadata):
     url = pinataBaseURL
 
-def uploadFileToPinata(filePath, name=None, keyValues=None, groupID=None, network="public"):
-    if not os.path.isfile(filePath):
-        raise FileNotFoundError(f"File not found: {filePath}")
-    
-    fileName = os.path.basename(filePath)
+#Upload a File to Pinata.  Pass either the path of the File on disk or its content as bytes in fileBytes,
+#in which case fileName must also be given as there is no path to take it from
+def uploadFileToPinata(filePath=None, name=None, keyValues=None, groupID=None, network="public", fileBytes=None, fileName=None):
+    #There is no separate check that the File exists as open() below raises FileNotFoundError anyway
+    if fileBytes is None:
+        fileName = fileName or os.path.basename(filePath)
+    elif not fileName:
+        raise ValueError("fileName is required when uploading bytes")
     print(f"The fileName is: {fileName}")
 
+    #The File is opened in a with block so that the handle is always closed once the upload is over.
+    #MultipartEncoder reads the File lazily in small chunks while sending, so the whole File is never held in memory
+    if fileBytes is None:
+        with open(filePath, "rb") as fileHandle:
+            return postFileToPinata(fileName, fileHandle, name, keyValues, groupID, network)
+    return postFileToPinata(fileName, fileBytes, name, keyValues, groupID, network)
+
+def postFileToPinata(fileName, fileContent, name, keyValues, groupID, network):
     # Build fields for multipart
     fields = {
-        "file": (fileName, open(filePath, "rb"), "application/octet-stream"),
+        "file": (fileName, fileContent, "application/octet-stream"),
         "network": network
     }
 
@@ -76,7 +157,7 @@ def uploadFileToPinata(filePath, name=None, keyValues=None, groupID=None, networ
     if groupID:
         fields["group_id"] = groupID
     if keyValues:
-        fields["keyvalues"] = json.dumps(keyValues)
+        fields["keyvalues"] = orjson.dumps(keyValues).decode()
 
     # Construct the multipart form data
     m = MultipartEncoder(fields=fields)
@@ -89,10 +170,10 @@ def uploadFileToPinata(filePath, name=None, keyValues=None, groupID=None, networ
 
     # POST request 
     # Here we use the v3 version of the Pinata API to upload the Files as you would see in the base URL that we are using
-    response = requests.post("https://uploads.pinata.cloud/v3/files",
-                             headers=headers,
-                             data=m,
-                             timeout=30)
+    response = SESSION.post("https://uploads.pinata.cloud/v3/files",
+                            headers=headers,
+                            data=m,
+                            timeout=30)
 
     if response.status_code != 200:
         raise requests.HTTPError(f"Upload failed: {response.status_code} - {response.text}")
@@ -116,7 +197,7 @@ def uploadMetadataToPinata(metadata):
         "Authorization": f"Bearer {pinataJWT}",
         "Content-Type": "application/json"
     }
-    response = requests.request("POST", url, json=metadata, headers=headers)
+    response = SESSION.post(url, json=metadata, headers=headers)
     if response.status_code != 200:
         raise requests.HTTPError(f"Pinning Metadata to Pinata Failed: {response.status_code} - {response.text}")
     
@@ -129,6 +210,7 @@ def uploadMetadataToPinata(metadata):
 @app.route("/canmint/<badge_type>", methods=["GET"])
 def canMint(badge_type):
     try:
+        _, contract = get_contract()
         result = contract.functions.canMintBadge(badge_type).call()
         minted = contract.functions.getMintedCount(badge_type).call()
         cap = contract.functions.badgeTypes(badge_type).call()[1]
@@ -140,6 +222,26 @@ def canMint(badge_type):
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+# Utility: build and sign the mintBadge transaction for the given nonce
+def signMintTransaction(recipient, badge_type, token_uri, nonce):
+    web3, contract = get_contract()
+    txn = contract.functions.mintBadge(recipient, badge_type, token_uri).build_transaction({
+        "from": accountAddress,
+        "nonce": nonce,
+        "chainId": get_chain_id(),
+        "gas": 300000,
+        "gasPrice": web3.to_wei("2", "gwei")
+    })
+    return web3.eth.account.sign_transaction(txn, private_key=privateKey)
+
+# Utility: sign and send one mintBadge transaction and return its transaction hash
+def sendMintTransaction(recipient, badge_type, token_uri):
+    web3, _ = get_contract()
+    nonce = get_nonce(accountAddress)
+    signed_txn = signMintTransaction(recipient, badge_type, token_uri, nonce)
+    tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction)
+    return web3.to_hex(tx_hash)
+
 # Endpoint: Mint a new badge
 @app.route("/mintBadge", methods=["POST"])
 def mintBadge():
@@ -150,17 +252,32 @@ def mintBadge():
     print
 
     try:
-        nonce = get_nonce(accountAddress)
-        txn = contract.functions.mintBadge(recipient, badge_type, token_uri).build_transaction({
-            "from": accountAddress,
-            "nonce": nonce,
-            "gas": 300000,
-            "gasPrice": web3.to_wei("2", "gwei")
-        })
+        return jsonify({"tx_hash": sendMintTransaction(recipient, badge_type, token_uri)})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
 
-        signed_txn = web3.eth.account.sign_transaction(txn, private_key=privateKey)
-        tx_hash = web3.eth.send_raw_transaction(signed_txn.raw_transaction)
-        return jsonify({"tx_hash": web3.to_hex(tx_hash)})
+# Endpoint: Mint many badges in one API call
+# Expects a JSON list of {"recipient": ..., "badge_type": ..., "token_uri": ...}
+@app.route("/mintBadgeBatch", methods=["POST"])
+def mintBadgeBatch():
+    items = request.get_json()
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty list of badges to mint"}), 400
+
+    try:
+        web3, _ = get_contract()
+        #Read the nonce only once and increment it ourselves for each transaction
+        base_nonce = get_nonce(accountAddress)
+        raw_transactions = [
+            signMintTransaction(item["recipient"], item["badge_type"], item["token_uri"], base_nonce + i).raw_transaction
+            for i, item in enumerate(items)
+        ]
+        #Send all the signed transactions to the node in ONE JSON-RPC batch request
+        with web3.batch_requests() as batch:
+            for raw_transaction in raw_transactions:
+                batch.add(web3.eth.send_raw_transaction(raw_transaction))
+            tx_hashes = batch.execute()
+        return jsonify({"tx_hashes": [web3.to_hex(tx_hash) for tx_hash in tx_hashes]})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -169,19 +286,41 @@ def mintBadge():
 def mintedCount(badge_type):
     print(f"Calling getMintedCount API - {badge_type}")
     try:
+        _, contract = get_contract()
         count = contract.functions.getMintedCount(badge_type).call()
         print(f"Count of Minted NFTS is: {count}")
         return jsonify({"minted_count": count})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
+
+# Endpoint: Get the minted count of many badge types in one API call
+# Expects {"badge_types": [...]} and returns {"<badge_type>": <minted count>, ...}
+# Badge types whose count could not be read are left out of the result
+@app.route("/getMintedCounts", methods=["POST"])
+def mintedCounts():
+    badge_types = (request.get_json() or {}).get("badge_types", [])
+    try:
+        _, contract = get_contract()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    counts = {}
+    for badge_type in badge_types:
+        #If the count of one Badge Type cannot be read we leave it out (rather than showing a wrong 0) so the others can still be shown
+        try:
+            counts[badge_type] = contract.functions.getMintedCount(badge_type).call()
+        except Exception as e:
+            print(f"Unable to get the Minted Count of {badge_type}: {e}")
+    return jsonify(counts)
     
 
 @app.route("/uploadMetadata", methods=["POST"])
 def upload_metadata():
     data = request.json
-    required_fields = ["student_name", "class_semester", "university", "badge_type"]
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Missing required fields"}), 400
+    #The set difference gives us the missing fields in one step so we can tell the caller exactly which ones they are
+    missing = REQUIRED_FIELDS - data.keys()
+    if missing:
+        return jsonify({"error": f"Missing required fields: {sorted(missing)}"}), 400
 
     student_name = data["student_name"]
     class_semester = data["class_semester"]
@@ -196,29 +335,37 @@ def upload_metadata():
     image_path =  imageFileName
     #image_path =  os.path.join(r"./certificates", imageFileName).replace("\\", "/")
     print(f"The Image Path is: {image_path}")
-    if not os.path.isfile(image_path):
+    #One stat call both checks that the image exists and gives its size and modified time for the CID cache below
+    try:
+        imageStat = os.stat(image_path)
+    except FileNotFoundError:
         return jsonify({"error": f"Image for badge type '{badge_type}' not found."}), 400
     # Upload Certificate PNG file to Pinata
-    image_cid = uploadFileToPinata(filePath=str(image_path), name=str(image_path), keyValues={"category": "Badge"})
-
-    #We are framing the Image URL that we hae uploaded to Pinata and we shall then create a Short URL to store it as it will save space
-    image_url = f"https://gateway.pinata.cloud/ipfs/{image_cid['cid']}"
-    s = pyshorteners.Shortener()
-    short_url = s.tinyurl.short(image_url)
-    #print(short_url)
+    #The Certificate image is the same for every Badge of a type and IPFS gives the same CID for the same content,
+    #so we upload it only once and reuse the CID on the next mints until the image file is changed
+    imageKey = ("imageCID", image_path, imageStat.st_size, imageStat.st_mtime_ns)
+    image_cid = badgeCache.get(imageKey)
+    if image_cid is None:
+        image_cid = uploadFileToPinata(filePath=str(image_path), name=str(image_path), keyValues={"category": "Badge"})
+        badgeCache.set(imageKey, image_cid)
+
+    #We store the Image as an ipfs:// URI built from its CID.  This is already short, so there is no need to call
+    #a URL shortener on every mint, and it does not tie the Metadata to any one gateway.
+    #It is turned into a gateway URL only when the Badges are listed
+    certificate_uri = f"ipfs://{image_cid['cid']}"
 
     #This is a sample of the structure that we are using to store the student details and the Image URL for their earned/granted badge
     #However this can also be a topic to discuss and see what actually should we upload as metadata to Pinata
     pinContent = {
         "image_cid":image_cid['cid'],
-        "certificate_url":short_url,
-        "attributes" : [
-            {"Student":student_name},
-            {"Class":class_semester},
-            {"University":university},
-            {"Date":grant_date},
-            {"Badge Type":badge_type}
-        ]
+        "certificate_url":certificate_uri,
+        "attributes" : {
+            "Student":student_name,
+            "Class":class_semester,
+            "University":university,
+            "Date":grant_date,
+            "Badge Type":badge_type
+        }
     }
     # Construct metadata
     #The pinataMetadata will be the name for the saved File in Pinata which will be studentname-badgetype
@@ -250,70 +397,130 @@ def upload_metadata():
         "metadata_uri": metadataURL
     }
 
-    # Add the Students Badge Data to the local JSON file.  As of now we use this but can also use a database like SQLLite or MongoDB
-    local_log_path = STUDENT_BADGE_DATA
-    if os.path.exists(local_log_path):
-        with open(local_log_path, "r") as f:
-            badge_data = json.load(f)
-    else:
-        badge_data = []
+    # Add the Students Badge Data to the local JSON Lines file.  As of now we use this but can also use a database like SQLLite or MongoDB
+    #Each record is appended as one line, so we never read and rewrite the whole file on every mint
+    #and two requests at the same time cannot overwrite each other's records
+    with open(STUDENT_BADGE_DATA, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    return jsonify({"metadata_uri": metadataURL}), 200
 
-    badge_data.append(record)
+# Endpoint: Upload the Metadata and Mint the Badge in one API call
+# Expects the fields of /uploadMetadata plus "recipient" and returns {"metadata_uri": ..., "tx_hash": ...}
+@app.route("/mintBadgeWithMetadata", methods=["POST"])
+def mintBadgeWithMetadata():
+    data = request.get_json()
+    if not data or "recipient" not in data:
+        return jsonify({"error": "Missing required fields: ['recipient']"}), 400
 
-    with open(local_log_path, "w") as f:
-        json.dump(badge_data, f, indent=2)
+    #upload_metadata reads its fields from this same request, so we call it directly instead of making another HTTP call
+    response, status = upload_metadata()
+    if status != 200:
+        return response, status
+    metadataURL = response.get_json()["metadata_uri"]
 
-    return jsonify({"metadata_uri": metadataURL}), 200
+    try:
+        tx_hash = sendMintTransaction(data["recipient"], data["badge_type"], metadataURL)
+    except Exception as e:
+        return jsonify({"error": str(e), "metadata_uri": metadataURL}), 400
+    return jsonify({"metadata_uri": metadataURL, "tx_hash": tx_hash})
+
+#Get the details of one Minted Badge from its Metadata URI.  Returns None if the Metadata could not be retrieved
+def getBadgeInfo(metadata_uri):
+    badge_data = badgeCache.get(("metadata", metadata_uri))
+    if badge_data is None:
+        print(f"Calling metadata uri with URL {metadata_uri}")
+        response = SESSION.get(metadata_uri, timeout=10)
+        if response.status_code != 200:
+            return None
+        badge_data = orjson.loads(response.content)
+        print("Got the Response from the Metadata URI")
+        badgeCache.set(("metadata", metadata_uri), badge_data, expire=METADATA_CACHE_SECONDS)
+    #Get the Certificate URL.  Newer Badges store an ipfs:// URI which we resolve to the gateway URL here
+    certificate_url = badge_data.get('certificate_url', 'N/A')
+    if certificate_url.startswith("ipfs://"):
+        certificate_url = IPFS_GATEWAY_URL + certificate_url[len("ipfs://"):]
+    student_collection = badge_data.get("attributes", {})
+    #Badges minted earlier stored the attributes as a list of single key dicts, so we merge them into one dict
+    if isinstance(student_collection, list):
+        student_collection = {key: value for attr in student_collection for key, value in attr.items()}
+    badge_info = OrderedDict([
+        ("Student Name", student_collection.get("Student", "N/A")),
+        ("Badge Grant Date", student_collection.get("Date", "N/A")),
+        ("Badge Type", student_collection.get("Badge Type", "N/A")),
+        ("Class or Semester", student_collection.get("Class", "N/A")),
+        ("University", student_collection.get("University", "N/A")),
+        ("Certificate URL", certificate_url)
+    ]       )
+    return badge_info
 
 #Use this API to get the list of Minted Badges directly from Blockchain
+#Optional query parameter fields=<comma separated names> returns only those fields of each Badge (in that order)
+#Optional query parameters limit and offset return one page of Badges as {"rows": [...], "total": <number of Badges>}
 @app.route("/list_minted_badges", methods=["GET"])
 def list_minted_badges():
     #if not os.path.exists(STUDENT_BADGE_DATA):
     #    return jsonify([])
-    #with open(STUDENT_BADGE_DATA, "r") as f:
-    #    return jsonify(json.load(f))
+    #with open(STUDENT_BADGE_DATA, "r", encoding="utf-8") as f:
+    #    return jsonify([json.loads(line) for line in f])
+
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be whole numbers"}), 400
+    if (limit is not None and limit <= 0) or offset < 0:
+        return jsonify({"error": "limit must be greater than 0 and offset cannot be negative"}), 400
 
     #Get the Total Badges Minted as of now from the Blockchain
     metadata_uris = []
     try:
+        web3, contract = get_contract()
         latest_id = contract.functions.totalSupply().call()  
         if latest_id <= 0:
+            if limit is not None:
+                return jsonify({"rows": [], "total": 0}), 200
             return jsonify(0), 200
-        for token_id in range(1, latest_id + 1):
-            #For each Token ID, get its Metadata URI
-            metadata_uri = contract.functions.tokenURI(token_id).call()
-            metadata_uris.append(metadata_uri)
+        #Token IDs are given out in order 1, 2, 3... so the cache keeps the list of Metadata URIs of the Tokens
+        #we have already read and we only ask the Blockchain for the ones minted since the last call
+        uriKey = ("tokenURIs", get_chain_key(), contractAddress)
+        metadata_uris = badgeCache.get(uriKey, [])
+        #More cached URIs than Tokens means the cache does not belong to this deploy, so we read all of them again
+        if len(metadata_uris) > latest_id:
+            metadata_uris = []
+        if len(metadata_uris) < latest_id:
+            #All the tokenURI calls are sent to the node as ONE JSON-RPC batch request instead of one HTTP call per token.
+            #The call data is the selector followed by the token ID as a 32 byte number and the result is an ABI encoded string
+            with web3.batch_requests() as batch:
+                for token_id in range(len(metadata_uris) + 1, latest_id + 1):
+                    callData = TOKEN_URI_SELECTOR + token_id.to_bytes(32, "big")
+                    batch.add(web3.eth.call({"to": contract.address, "data": Web3.to_hex(callData)}))
+                metadata_uris = metadata_uris + [abi_decode(["string"], result)[0] for result in batch.execute()]
+            badgeCache.set(uriKey, metadata_uris)
+        metadata_uris = metadata_uris[:latest_id]
     except Exception as e:
         return jsonify({"Unable to get the Minted Badges - Error getting the Token URI": str(e)}), 400
 
+    #For a page of Badges we only fetch the Metadata of the Badges on that page
+    if limit is not None:
+        metadata_uris = metadata_uris[offset:offset + limit]
+
     #If we have the Metadata URIs from the Blockchain, we will retrieve the details of the Minted Badges
-    results = []
-    for metadata_uri in metadata_uris:
-        try:
-            print(f"Calling metadata uri with URL {metadata_uri}")
-            response = requests.get(metadata_uri)
-            if response.status_code != 200:
-                continue
-            badge_data = response.json()
-            print("Got the Response from the Metadata URI")
-            #Get the Certificate URL
-            certificate_url = badge_data.get('certificate_url', 'N/A')
-            attributes = badge_data.get("attributes", [])
-            student_collection = {
-                list(attr.keys())[0]: list(attr.values())[0] for attr in attributes
-            }
-            badge_info = OrderedDict([
-                ("Student Name", student_collection.get("Student", "N/A")),
-                ("Badge Grant Date", student_collection.get("Date", "N/A")),
-                ("Badge Type", student_collection.get("Badge Type", "N/A")),
-                ("Class or Semester", student_collection.get("Class", "N/A")),
-                ("University", student_collection.get("University", "N/A")),
-                ("Certificate URL", certificate_url)
-            ]       )
-            results.append(badge_info)
-        except Exception as e:
-            return jsonify({"Unable to get the Minted Badges - Error getting Certificate and Student Badge details": str(e)}), 400
-        
+    #Each fetch waits on the network, so all of them are done in parallel and the total time is that of the slowest one
+    try:
+        with ThreadPoolExecutor(max_workers=METADATA_FETCH_THREADS) as executor:
+            results = [badge_info for badge_info in executor.map(getBadgeInfo, metadata_uris) if badge_info is not None]
+    except Exception as e:
+        return jsonify({"Unable to get the Minted Badges - Error getting Certificate and Student Badge details": str(e)}), 400
+
+    #Send only the fields the caller asked for so the response is smaller and the client does not have to drop the rest
+    fields = request.args.get("fields")
+    if fields:
+        fields = [field for field in fields.split(",") if field]
+        results = [{field: badge_info.get(field, "N/A") for field in fields} for badge_info in results]
+
+    if limit is not None:
+        return jsonify({"rows": results, "total": latest_id}), 200
     return jsonify(results), 200
                     
 
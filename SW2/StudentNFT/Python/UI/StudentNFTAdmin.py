@@ -1,34 +1,86 @@
 #StudentNFTAdmin.py
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import date
 import json
+import orjson #API responses are parsed with orjson which is much faster than json (still used to read the Student Wallets file)
+import html
 import pandas as pd
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 API_URL = "http://127.0.0.1:5000"
+#Columns of the Granted Badges table in the order they are shown
+cols_order = ["Student Name", "Badge Grant Date", "Badge Type", "Class or Semester", "University", "Certificate URL"]
+BADGES_PER_PAGE = 50 #Number of Granted Badges fetched from the API and shown at a time
+PREFETCH_MAX_AGE = 30 #Seconds for which the Granted Badges prefetched from the Home page are used on the View page
 
 badgeTypes = ["TopQuizzer", "PitchMaster", "TopInnovator"]
-studentWallets = {}
-with open("./StudentWalletMapping.json") as f:
-    studentWallets = json.load(f)
-
-# Formatting the data to print the Table for the Minted/Granted Badges
-def format_data_for_display(raw_data):
-    formatted_data = []
-    for item in raw_data:
-        cert_url = item.get('metadata_uri', '')
-
-        formatted_item = {
-            "Student Name": item.get("student_name", ""),
-            "Class/Semester": item.get("class_semester", ""),
-            "Badge Type": item.get("badge_type", ""),
-            "Grant Date": item.get("grant_date", ""),
-            "University": item.get("university", ""),
-            "Metadata URL": item.get('metadata_uri', '')
-        }
-        formatted_data.append(formatted_item)
-    return formatted_data
+#The Student Wallets file is read only once and kept in memory by Streamlit instead of on every rerun of this script.
+#It is only needed on the Mint page, so it is loaded there and not at all if the admin never mints
+@st.cache_data
+def load_wallets():
+    with open("./StudentWalletMapping.json") as f:
+        return json.load(f)
+
+#Streamlit runs this whole script again on every click, so the HTTP Session is created once with st.cache_resource
+#and its connections to the API are kept open (keep-alive) across the reruns.  All the calls to the API go through it
+@st.cache_resource
+def get_session():
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(total=2, backoff_factor=0.2)))
+    return session
+
+#Background thread used to get the Granted Badges from the API while the admin is still on the Home page
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+#Query parameters to get one page of the Granted Badges with only the columns that we show
+def granted_params(pageNumber):
+    return {
+        "fields": ",".join(cols_order),
+        "limit": BADGES_PER_PAGE,
+        "offset": (pageNumber - 1) * BADGES_PER_PAGE
+    }
+
+#Get the Minted Counts of all the Badge Types in ONE call to the API, as the DataFrame for the chart.  Badge Types whose
+#count could not be read are left out.  The DataFrame is kept for 30 seconds so clicking around the UI does not call the API
+#or build it again every time.  A failed call raises an error instead of returning, so the failure is not kept in the cache
+@st.cache_data(ttl=30)
+def fetch_counts(badge_types: tuple):
+    response = get_session().post(f"{API_URL}/getMintedCounts", json={"badge_types": list(badge_types)}, timeout=10)
+    response.raise_for_status()
+    counts = orjson.loads(response.content)
+    print(counts)
+    countTypes = [bType for bType in badge_types if bType in counts]
+    #The DataFrame is built from a column of counts with the Badge Types as its index.
+    #This is faster than building it from a list of row dicts and then calling set_index
+    return pd.DataFrame({"Minted Counts": [counts[bType] for bType in countTypes]},
+                        index=pd.Index(countTypes, name="Badge Type"))
+
+#Build an HTML table of the given columns straight from the list of rows (dicts) returned by the API
+def build_html_table(rows, columns):
+    header = "".join(f"<th>{html.escape(col)}</th>" for col in columns)
+    body = "".join(
+        "<tr>" + "".join(f"<td>{html.escape(str(row.get(col, '')))}</td>" for col in columns) + "</tr>"
+        for row in rows
+    )
+    return f"<table><thead><tr>{header}</tr></thead><tbody>{body}</tbody></table>"
+
+#Turn the page of Granted Badges returned by the API into an HTML table (None if there are no Badges) along with the
+#total number of Badges.  A page is small, so we write the HTML ourselves as building a DataFrame only to show it is extra work.
+#It is cached on the raw bytes of the API response, so on a rerun with the same Badges nothing is parsed or built again
+@st.cache_data(ttl=60)
+def granted_table(payload_bytes: bytes):
+    data = orjson.loads(payload_bytes)
+    rows, total = data["rows"], data["total"]
+    if not rows:
+        return None, total
+    return build_html_table(rows, cols_order), total
 
 # Sidebar navigation
 page = st.sidebar.radio("Menu", ["🏠 Home", "🪙 Mint Badge NFT", "🎖️ View Granted Badges"], index=0)
@@ -47,31 +99,29 @@ if page == "🏠 Home":
     Use the sidebar to access admin functions.
     """)
 
+    #The admin usually goes to View Granted Badges next, so we start getting its first page in the background now
+    #It is stored with the time it was started so that an old prefetch is not shown on the View page
+    if "granted_future" not in st.session_state:
+        st.session_state.granted_future = (time.monotonic(), get_executor().submit(
+            get_session().get, f"{API_URL}/list_minted_badges", params=granted_params(1), timeout=30))
+
     st.subheader("Minted Badges Count")
-    mintedCount = []
-    for bType in badgeTypes:
-        url = f"{API_URL}/getMintedCount/{bType}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            print(data)
-            mintedCount.append({
-            "Badge Type": bType,
-            "Minted Counts": data["minted_count"]
-            })
-            #print(mintedCount)
-
-    if len(mintedCount) > 0:
-        df = pd.DataFrame(mintedCount)
-        #df.columns = ['Badge Type', 'Minted Count']
+    try:
+        df = fetch_counts(tuple(badgeTypes))
+    except requests.RequestException as e:
+        print(f"Unable to get the Minted Counts: {e}")
+        df = pd.DataFrame()
+
+    if len(df) > 0:
         #st.table(df)
-        st.bar_chart(df.set_index('Badge Type'))
+        st.bar_chart(df)
     else:
         st.write("No Badges Created yet")        
 
 if page == "🪙 Mint Badge NFT":
     #Let us now Mint a New Badge
     st.header("Mint a New Badge")
+    studentWallets = load_wallets()
     badge_type = st.selectbox("Select Badge Type", badgeTypes)
     student = st.selectbox("Select a Student", list(studentWallets.keys()))
     student_address = studentWallets[student]
@@ -82,30 +132,29 @@ if page == "🪙 Mint Badge NFT":
 
     submitButton = st.button("Mint Badge NFT")
     if submitButton:
-        # Call the API to mint the badge
+        # Call the API to upload the Metadata and mint the badge in ONE call
         payload = {
             "student_name": student,
             "class_semester": studentClass,
             "university": studentUniversity,
-            "badge_type": badge_type
+            "badge_type": badge_type,
+            "recipient": student_address
         }
 
-        response = requests.post(f"{API_URL}/uploadMetadata", json=payload)
-        if response.status_code == 200:
-            metaDataURI = response.json().get("metadata_uri")
+        response = get_session().post(f"{API_URL}/mintBadgeWithMetadata", json=payload)
+        #If the API failed before it could answer in JSON (for example a Pinata error) we treat it as a failed Metadata upload
+        result = orjson.loads(response.content) if response.headers.get("Content-Type", "").startswith("application/json") else {}
+        metaDataURI = result.get("metadata_uri")
+        if metaDataURI:
             st.success(f"Metadata uploaded successfully! IPFS URI: {metaDataURI}")
-            #Now Mint the Badge on the Blockchain - Call /mintBadge
-            badgeData = {
-                    "recipient": student_address,
-                    "badge_type": badge_type,
-                    "token_uri": metaDataURI
-                }
-            mintStatus = requests.post(f"{API_URL}/mintBadge", json=badgeData)
-            if mintStatus.status_code == 200:
-                mintHash = mintStatus.json().get("tx_hash")
+            if response.status_code == 200:
+                mintHash = result.get("tx_hash")
                 st.success(f"The New Badge is Minted successfully! Transaction Hash: {mintHash}")
+                #The counts and the Granted Badges have changed, so they must be fetched again from the API
+                fetch_counts.clear()
+                st.session_state.pop("granted_future", None)
             else:
-                st.error(f"Error Minting the Badge - mintBadge API returned Error: {mintStatus.text}")                
+                st.error(f"Error Minting the Badge - mintBadge API returned Error: {result.get('error')}")
 
         else:
             st.error("Error Minting the Badge - Upload Meta Data Filed. Please check the details.")
@@ -113,20 +162,32 @@ if page == "🪙 Mint Badge NFT":
 
 if page == "🎖️ View Granted Badges":
     st.header("View Granted Badges")
+    if st.button("🔄 Refresh"):
+        granted_table.clear()
+        st.session_state.pop("granted_future", None)
     # Let us Get the Count of Badges Minted on this Platform
     url = f"{API_URL}/list_minted_badges"
-    response = requests.get(url)
+    #Ask the API only for the columns that we show and only for the Badges on the selected page
+    pageNumber = st.number_input("Page", min_value=1, value=1, step=1)
+    #Use the first page fetched in the background from the Home page if we have it and it is recent.  It is used only once
+    #so we do not keep showing old data, and if it failed we simply call the API again
+    response = None
+    submittedAt, future = st.session_state.pop("granted_future", (None, None))
+    if future is not None and pageNumber == 1 and time.monotonic() - submittedAt <= PREFETCH_MAX_AGE:
+        try:
+            response = future.result(timeout=5)
+        except Exception as e:
+            print(f"Prefetch of the Granted Badges failed: {e}")
+    if response is None:
+        response = get_session().get(url, params=granted_params(pageNumber))
     if response.status_code == 200:
-        data = response.json()
-        if data == 0:
-            st.write("No Badges Granted yet")
-        else:    
-            #formattedData = format_data_for_display(data)
-            cols_order = ["Student Name", "Badge Grant Date", "Badge Type", "Class or Semester", "University", "Certificate URL"]
-            df = pd.DataFrame(data)
-            df = df[cols_order]
-            st.table(df)
-            #st.write(df.to_html(escape=False, index=False), unsafe_allow_html=True)
+        table, total = granted_table(response.content)
+        if total > 0:
+            st.caption(f"Page {pageNumber} of {(total + BADGES_PER_PAGE - 1) // BADGES_PER_PAGE} - {total} Badges Granted")
+        if table is None:
+            st.write("No Badges Granted yet" if total == 0 else "No Badges on this page")
+        else:
+            st.markdown(table, unsafe_allow_html=True)
     else:
         st.info(f"No Badges Granted yet - {response.content}")
     
@@ -0,0 +1,11 @@
+#Gunicorn settings to run the Flask API with a pool of workers instead of the single threaded Flask development server
+#Start it from this folder with:  gunicorn StudentNFTAPI:app
+#Note: gunicorn does not run on Windows, use WSL or keep using "python StudentNFTAPI.py" there for development
+
+bind = "127.0.0.1:5000" #Same address as the Flask development server so the Streamlit UI does not need any change
+workers = 4 #Number of worker processes
+#gevent workers run every request in a light weight greenlet.  The worker patches the standard library (sockets, ssl, threads)
+#before our app is imported, so while one request waits on Pinata or the Blockchain node the others keep running
+worker_class = "gevent"
+worker_connections = 1000 #Maximum number of requests that one worker handles at the same time
+timeout = 60 #Minting uploads the certificate and the metadata to Pinata which can take a while